@@ -153,6 +153,18 @@ def _validate_te_torch_wheel(path, core_dist):
         )
 
 
+def expected_wheels(args):
+    """File names of the wheel triplet build() leaves in the wheel dir."""
+    core_dist = f"transformer_engine_cu{int(args.cuda[:2])}"
+    arch = "x86_64" if args.arch == "x86" else args.arch
+    python_tag = f"cp{sys.version_info.major}{sys.version_info.minor}"
+    return [
+        f"transformer_engine-{TE_VERSION}-py3-none-any.whl",
+        f"{core_dist}-{TE_VERSION}-py3-none-manylinux_2_28_{arch}.whl",
+        f"transformer_engine_torch-{TE_VERSION}-{python_tag}-{python_tag}-linux_{arch}.whl",
+    ]
+
+
 def build(args, wheel_dir, run):
     _validate_te_build_environment(args)
     cuda_major = int(args.cuda[:2])
@@ -207,13 +219,7 @@ def build(args, wheel_dir, run):
         },
     )
 
-    arch = "x86_64" if args.arch == "x86" else args.arch
-    python_tag = f"cp{sys.version_info.major}{sys.version_info.minor}"
-    expected = [
-        f"transformer_engine-{TE_VERSION}-py3-none-any.whl",
-        f"{core_dist}-{TE_VERSION}-py3-none-manylinux_2_28_{arch}.whl",
-        f"transformer_engine_torch-{TE_VERSION}-{python_tag}-{python_tag}-linux_{arch}.whl",
-    ]
+    expected = expected_wheels(args)
     missing = [
         name for name in expected
         if not os.path.isfile(os.path.join(wheel_dir, name))
@@ -2,13 +2,22 @@
 """Build GPU wheels (flash-attn, apex, transformer_engine, etc.)."""
 
 import argparse
+import concurrent.futures
+import fcntl
+import functools
 import glob
+import hashlib
+import importlib.metadata
 import json
+import multiprocessing
 import os
+import queue
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
+import traceback
 
 import build_sglang_gateway
 import build_transformer_engine
@@ -17,80 +26,434 @@ WHEEL_DIR = os.environ.get("WHEEL_DIR", "/tmp/wheels")
 if not os.path.isabs(WHEEL_DIR):
     raise ValueError(f"WHEEL_DIR must be an absolute path, got {WHEEL_DIR!r}")
 
+# Everything build reuses across runs (pip downloads, git mirrors, sccache)
+# lives under one root, so CI can persist it as a single cache path.
+CACHE_ROOT = os.path.expanduser(os.environ.get("MILES_WHEELS_CACHE", "~/.cache/miles-wheels"))
+
+# Bare mirrors of cloned sources, reused across runs. A mirror's first clone
+# takes full history, which only pays off if the cache outlives the run, so
+# it is used only when GIT_CACHE_DIR or MILES_WHEELS_CACHE is set; otherwise
+# (or with GIT_CACHE_DIR empty) sources are shallow-cloned.
+if "GIT_CACHE_DIR" in os.environ:
+    GIT_CACHE_DIR = os.path.expanduser(os.environ["GIT_CACHE_DIR"])
+elif "MILES_WHEELS_CACHE" in os.environ:
+    GIT_CACHE_DIR = os.path.join(CACHE_ROOT, "git")
+else:
+    GIT_CACHE_DIR = ""
+
 REPO = "yueming-yuan/miles-wheels"
+PY_TAG = f"cp{sys.version_info.major}{sys.version_info.minor}"
+
+# Share of os.cpu_count() the current process may hand to compilers. None
+# means the whole machine; narrowed in each worker by `build --jobs N`.
+_cpu_budget = None
+
+# Peak RAM of one nvcc compile job on the heavier (flash-attn style) kernels.
+GB_PER_COMPILE_JOB = 4
+
+
+def _cpu_share():
+    return _cpu_budget or os.cpu_count() or 1
+
+
+def _available_memory_gb():
+    """MemAvailable from /proc/meminfo, or None where that doesn't exist."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+    return None
+
+
+def _env_int(name, lo, hi):
+    """Integer env override clamped to [lo, hi]; None if unset or invalid."""
+    value = os.environ.get(name)
+    if value is None:
+        return None
+    try:
+        return max(lo, min(int(value), hi))
+    except ValueError:
+        print(f"WARNING: ignoring non-integer {name}={value!r}")
+        return None
+
+
+def _num_cuda_arches():
+    arch_list = os.environ.get("TORCH_CUDA_ARCH_LIST", "").replace(";", " ")
+    return max(1, len(arch_list.split()))
+
+
+def compute_jobs():
+    """Return (max_jobs, nvcc_threads) sized to this process's CPUs and free RAM.
+
+    Each nvcc thread compiles one arch and peaks like a separate job, so
+    max_jobs * nvcc_threads is kept within RAM at GB_PER_COMPILE_JOB each
+    so small builders don't get OOM-killed. Jobs get the RAM first; threads
+    only take cores and RAM the jobs leave over, and more threads than
+    TORCH_CUDA_ARCH_LIST entries buys nothing. MAX_JOBS / NVCC_THREADS set
+    in the environment win, clamped to the CPU share.
+    """
+    cpus = _cpu_share()
+    ram_slots = cpus
+    free_gb = _available_memory_gb()
+    if free_gb is not None:
+        free_gb *= cpus / (os.cpu_count() or cpus)
+        ram_slots = max(1, int(free_gb / GB_PER_COMPILE_JOB))
+    max_jobs = _env_int("MAX_JOBS", 1, cpus)
+    if max_jobs is None:
+        max_jobs = min(cpus, ram_slots)
+    nvcc_threads = _env_int("NVCC_THREADS", 1, cpus)
+    if nvcc_threads is None:
+        nvcc_threads = max(1, min(_num_cuda_arches(), cpus // max_jobs, ram_slots // max_jobs))
+    return max_jobs, nvcc_threads
+
+
+def _pip_daemon_loop(requests, results):
+    """_PipDaemon process body: run pip argv lists in-process, one at a time."""
+    from pip._internal.cli.main import main as pip_main
+
+    home = os.getcwd()
+    for argv, env, cwd in iter(requests.get, None):
+        os.environ.clear()
+        os.environ.update(env)
+        os.chdir(cwd or home)
+        try:
+            code = pip_main(argv)
+        except SystemExit as exc:
+            code = exc.code if exc.code is None or isinstance(exc.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        results.put(code or 0)
+
+
+class _PipDaemon:
+    """One long-lived process that runs `pip ...` commands through pip's internal API.
+
+    Saves the interpreter start and pip import of every `python -m pip`.
+    pip._internal is not a stable API, so this is opt-in (`build
+    --pip-daemon`); by default pip runs as an ordinary subprocess.
+    """
+
+    def __init__(self):
+        self._requests = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._proc = multiprocessing.Process(
+            target=_pip_daemon_loop, args=(self._requests, self._results), daemon=True)
+        self._proc.start()
+
+    def run(self, argv, env, cwd):
+        self._requests.put((argv, env, cwd))
+        while True:
+            try:
+                return self._results.get(timeout=1)
+            except queue.Empty:
+                if not self._proc.is_alive():
+                    print(f"pip daemon died (exit code {self._proc.exitcode})")
+                    return 1
+
+    def close(self):
+        self._requests.put(None)
+        self._proc.join()
+
+
+# Set by `build --pip-daemon`; run() then routes `python -m pip` through it.
+_pip_daemon = None
 
 
-def run(cmd, *, env=None, cwd=None):
-    """Run a command, streaming output. Exit on failure."""
+def run(cmd, *, env=None, cwd=None, check=True):
+    """Run a command, streaming its combined output. Exit on failure unless check=False.
+
+    Output is relayed line by line through sys.stdout rather than inherited,
+    so it lands wherever this process's output currently goes (the per-step
+    log under `build --jobs N`). Returns the exit code.
+    """
     merged_env = {**os.environ, **(env or {})}
     print(f"\n{'='*60}")
     print(f"Running: {' '.join(cmd)}")
-    print(f"{'='*60}\n")
-    result = subprocess.run(cmd, env=merged_env, cwd=cwd)
-    if result.returncode != 0:
-        print(f"FAILED (exit code {result.returncode}): {cmd}")
-        sys.exit(result.returncode)
+    print(f"{'='*60}\n", flush=True)
+    if _pip_daemon is not None and cmd[:3] == [sys.executable, "-m", "pip"]:
+        returncode = _pip_daemon.run(cmd[3:], merged_env, cwd)
+    else:
+        with subprocess.Popen(cmd, env=merged_env, cwd=cwd, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True, bufsize=1,
+                              errors="replace") as proc:
+            for line in proc.stdout:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        returncode = proc.returncode
+    if check and returncode != 0:
+        print(f"FAILED (exit code {returncode}): {cmd}")
+        sys.exit(returncode)
+    return returncode
+
+
+def _default_arch_list(arch):
+    """TORCH_CUDA_ARCH_LIST release wheels are built for."""
+    return "8.0;8.6;8.9;9.0;10.0;10.3" if arch == "x86" else "9.0;10.0;10.3"
 
 
 def _setup_env(args):
+    # Inherited by every pip call below (download, wheel, install and the
+    # build-requires they fetch). The TE torch wheel keeps its --no-cache-dir.
+    os.environ.setdefault("PIP_CACHE_DIR", os.path.join(CACHE_ROOT, "pip"))
+    os.makedirs(os.environ["PIP_CACHE_DIR"], exist_ok=True)
+
     cuda_major, cuda_minor = args.cuda[:2], args.cuda[2:]
     print(f"CUDA  : {cuda_major}.{cuda_minor}  (cu{args.cuda})")
     print(f"Arch  : {args.arch}")
-    os.environ.setdefault(
-        "TORCH_CUDA_ARCH_LIST",
-        "8.0;8.6;8.9;9.0;10.0;10.3" if args.arch == "x86" else "9.0;10.0;10.3",
-    )
+    if args.arch_list:
+        os.environ["TORCH_CUDA_ARCH_LIST"] = args.arch_list
+    os.environ.setdefault("TORCH_CUDA_ARCH_LIST", _default_arch_list(args.arch))
     os.environ["CUDA_VERSION"] = f"{cuda_major}.{cuda_minor}"
     print(f"TORCH_CUDA_ARCH_LIST: {os.environ['TORCH_CUDA_ARCH_LIST']}")
+    if args.compiler_cache:
+        _setup_compiler_cache()
+
+
+def _setup_compiler_cache():
+    """Route CUDA/C/C++/Rust compiles through sccache when it is installed.
+
+    torch.utils.cpp_extension takes nvcc from PYTORCH_NVCC, CMake projects use
+    the *_COMPILER_LAUNCHER variables, and cargo uses RUSTC_WRAPPER. CC/CXX
+    are left alone: cpp_extension passes $CC to nvcc as -ccbin, which must be
+    a single compiler path, not "sccache gcc". Existing settings win.
+    """
+    sccache = shutil.which("sccache")
+    if sccache is None:
+        print("Compiler cache: off (sccache not on PATH)")
+        return
+    nvcc = os.path.join(os.environ.get("CUDA_HOME", "/usr/local/cuda"), "bin", "nvcc")
+    cache_env = {
+        "SCCACHE_DIR": os.path.join(CACHE_ROOT, "sccache"),
+        "SCCACHE_CACHE_SIZE": "50G",
+        "PYTORCH_NVCC": f"{sccache} {nvcc}",
+        "CMAKE_C_COMPILER_LAUNCHER": sccache,
+        "CMAKE_CXX_COMPILER_LAUNCHER": sccache,
+        "CMAKE_CUDA_COMPILER_LAUNCHER": sccache,
+        "RUSTC_WRAPPER": sccache,
+    }
+    for key, value in cache_env.items():
+        os.environ.setdefault(key, value)
+    os.makedirs(os.environ["SCCACHE_DIR"], exist_ok=True)
+    print(f"Compiler cache: {sccache} ({os.environ['SCCACHE_DIR']})")
+
+
+@functools.lru_cache(maxsize=None)
+def _git_supports_filter():
+    """Partial clone (--filter=blob:none) needs git >= 2.27."""
+    out = subprocess.check_output(["git", "--version"], text=True)
+    version = tuple(int(p) for p in out.split()[2].split(".")[:2])
+    return version >= (2, 27)
+
+
+def shallow_clone(url, dst, ref=None):
+    """Clone only what one checkout needs.
+
+    Without *ref* this is a depth-1 clone of the default branch tip. A pinned
+    *ref* may sit anywhere in history, so take a blobless clone instead (all
+    commits and trees, file contents fetched lazily) and check it out.
+    """
+    blobless = ["--filter=blob:none"] if _git_supports_filter() else []
+    if ref is None:
+        run(["git", "clone", *blobless, "--depth=1", url, dst])
+    else:
+        run(["git", "clone", *blobless, "--no-checkout", url, dst])
+        run(["git", "-C", dst, "checkout", ref])
+
+
+def git_cached_clone(url, ref, dst):
+    """Clone *url* at *ref* (None: default branch) into *dst* via a local mirror.
+
+    The first use of a URL creates a bare clone of its branches and tags
+    under GIT_CACHE_DIR; later uses only fetch new objects into it, and
+    *dst* borrows its objects through --reference. The cache has to be
+    complete (not blobless) for that to work, but it skips refs/pull/*,
+    which on busy GitHub repos is most of the history. A per-mirror flock
+    keeps concurrent steps from updating it at the same time.
+    """
+    if not GIT_CACHE_DIR:
+        shallow_clone(url, dst, ref)
+        return
+
+    os.makedirs(GIT_CACHE_DIR, exist_ok=True)
+    mirror = os.path.join(GIT_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest() + ".git")
+    with open(mirror + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.isdir(mirror):
+            partial = mirror + ".partial"
+            shutil.rmtree(partial, ignore_errors=True)
+            run(["git", "clone", "--bare", url, partial])
+            # clone --bare sets no fetch refspec; keep later fetches to branches and tags.
+            run(["git", "-C", partial, "config", "remote.origin.fetch",
+                 "+refs/heads/*:refs/heads/*"])
+            run(["git", "-C", partial, "config", "--add", "remote.origin.fetch",
+                 "+refs/tags/*:refs/tags/*"])
+            os.rename(partial, mirror)
+        else:
+            run(["git", "-C", mirror, "fetch", "--prune", "origin"])
+        run(["git", "clone", "--reference", mirror, "--no-checkout", url, dst])
+    run(["git", "-C", dst, "checkout", ref or "origin/HEAD"])
+
+
+# Abort a submodule fetch that stays under 1 KB/s for a minute instead of
+# letting a stalled GitHub connection hang the build.
+GIT_LOW_SPEED_ENV = {"GIT_HTTP_LOW_SPEED_LIMIT": "1000", "GIT_HTTP_LOW_SPEED_TIME": "60"}
+
+
+def update_submodules(repo_dir, attempts=3):
+    """Shallow-fetch all submodules in parallel, retrying with backoff on failure."""
+    cmd = ["git", "-C", repo_dir, "submodule", "update", "--init", "--recursive",
+           "--jobs", str(os.cpu_count() or 4), "--depth=1", "--recommend-shallow"]
+    for attempt in range(1, attempts + 1):
+        code = run(cmd, env=GIT_LOW_SPEED_ENV, check=attempt == attempts)
+        if code == 0:
+            return
+        delay = 10 * 2 ** (attempt - 1)
+        print(f"Submodule update failed (attempt {attempt}/{attempts}), retrying in {delay}s")
+        time.sleep(delay)
+
+
+def _checked_out_at(repo_dir, commit):
+    """True if *repo_dir* is a checkout of *commit* with no tracked changes and
+    every submodule initialised at its recorded commit.
+
+    The submodule check matters: checkout finishes before update_submodules,
+    so a run that died in between must not be mistaken for a usable tree.
+    """
+    head = subprocess.run(["git", "-C", repo_dir, "rev-parse", "HEAD"],
+                          capture_output=True, text=True)
+    if head.returncode != 0 or head.stdout.strip() != commit:
+        return False
+    status = subprocess.run(
+        ["git", "-C", repo_dir, "status", "--porcelain", "--untracked-files=no"],
+        capture_output=True, text=True,
+    )
+    if status.returncode != 0 or status.stdout.strip():
+        return False
+    # Each line starts with ' ' when in sync, '-' uninitialised, '+' at
+    # another commit, 'U' conflicted.
+    submodules = subprocess.run(
+        ["git", "-C", repo_dir, "submodule", "status", "--recursive"],
+        capture_output=True, text=True,
+    )
+    return submodules.returncode == 0 and all(
+        line.startswith(" ") for line in submodules.stdout.splitlines())
 
 
 # ── build steps ──────────────────────────────────────────────
 
-def _build_flash_attn(args):
-    run(
+FLASH_ATTN_VERSION = "2.7.4.post1"
+# Must stay >= 00756db: transformer_engine 2.17 passes window_size_left/right
+# to FA3's _flash_attn_forward/_backward, which older revisions (incl. the
+# previous pin, 3.0.0b1) only accept as a single window_size tuple.
+FLASH_ATTN_HOPPER_COMMIT = "00756db9d921da0846453283ddfbeb7457abd09b"
+APEX_COMMIT = "10417aceddd7d5d05d7cbf7b0fc2daad1105f8b4"
+CAUSAL_CONV1D_VERSION = "1.6.1"
+MAMBA_SSM_VERSION = "2.3.1"
+# Extensions apex builds side by side; most are a handful of TUs, so more
+# parallelism goes to ninja inside each one instead.
+APEX_MAX_PARALLEL_EXTENSIONS = 8
+
+# Steps that are a single `pip wheel <spec>`: name -> (spec, extra env).
+# cmd_build folds the selected ones into one pip invocation.
+PIP_WHEEL_STEPS = {
+    "flash-attn": (f"flash-attn=={FLASH_ATTN_VERSION}", {}),
+    # FORCE_BUILD: upstream setup.py otherwise downloads its own prebuilt wheel
+    # when one matches, which never exists for aarch64/cu13 and may mismatch
+    # this image's torch build on x86.
+    "causal-conv1d": (f"causal-conv1d=={CAUSAL_CONV1D_VERSION}",
+                      {"CAUSAL_CONV1D_FORCE_BUILD": "TRUE"}),
+    # FORCE_BUILD: same reason as causal-conv1d.
+    "mamba-ssm": (f"mamba-ssm=={MAMBA_SSM_VERSION}", {"MAMBA_FORCE_BUILD": "TRUE"}),
+    "fast-hadamard": (
+        "git+https://github.com/Dao-AILab/fast-hadamard-transform.git"
+        "@e7706faf8d1c3b9f241e36860640ad1dac644ede", {},
+    ),
+}
+
+
+def _build_pip_wheels(names, args):
+    """Build the given PIP_WHEEL_STEPS with a single `pip wheel` call.
+
+    One pip process resolves, hits the index and starts up once for all of
+    them; their env vars don't overlap, so the union is passed. pip keeps
+    the wheels that built before one fails, so those are stamped even when
+    the call as a whole fails, and the next run skips them.
+    """
+    specs, env = [], {}
+    for name in names:
+        spec, step_env = PIP_WHEEL_STEPS[name]
+        specs.append(spec)
+        env.update(step_env)
+    max_jobs, nvcc_threads = compute_jobs()
+    # Slack for filesystems with coarse mtimes.
+    started = time.time() - 2
+    returncode = run(
         [sys.executable, "-m", "pip", "wheel",
-         "flash-attn==2.7.4.post1",
+         *specs,
          "-v", "--no-build-isolation", "--no-deps",
          "-w", WHEEL_DIR],
-        env={"MAX_JOBS": "64"},
+        env={**env, "MAX_JOBS": str(max_jobs), "NVCC_THREADS": str(nvcc_threads)},
+        check=False,
     )
+    expected = _expected_outputs(args)
+    for name in names:
+        patterns = expected[name][0]
+        if all(any(os.path.getmtime(f) >= started
+                   for f in glob.glob(os.path.join(WHEEL_DIR, p))) for p in patterns):
+            _write_stamps([name], expected)
+    if returncode != 0:
+        print(f"FAILED (exit code {returncode}): pip wheel {' '.join(names)}")
+        sys.exit(returncode)
 
 
 def _build_flash_attn_hopper(args):
+    # The tree is kept after a build, so a re-run at the same pin skips the
+    # clone and submodule init and lets setup.py reuse its build/ objects.
     repo_dir = "/tmp/flash-attention"
-    if os.path.exists(repo_dir):
-        shutil.rmtree(repo_dir)
-
-    run(["git", "clone", "https://github.com/Dao-AILab/flash-attention.git", repo_dir])
-    # Must stay >= 00756db: transformer_engine 2.17 passes window_size_left/right
-    # to FA3's _flash_attn_forward/_backward, which older revisions (incl. the
-    # previous pin, 3.0.0b1) only accept as a single window_size tuple.
-    run(["git", "checkout", "00756db9d921da0846453283ddfbeb7457abd09b"], cwd=repo_dir)
-    run(["git", "submodule", "update", "--init"], cwd=repo_dir)
+    if not _checked_out_at(repo_dir, FLASH_ATTN_HOPPER_COMMIT):
+        if os.path.exists(repo_dir):
+            shutil.rmtree(repo_dir)
+        git_cached_clone("https://github.com/Dao-AILab/flash-attention.git",
+                         FLASH_ATTN_HOPPER_COMMIT, repo_dir)
+        update_submodules(repo_dir)
+    hopper_dist = os.path.join(repo_dir, "hopper", "dist")
+    # A reused tree still holds the previous run's wheel; only ship this one.
+    shutil.rmtree(hopper_dist, ignore_errors=True)
+    max_jobs, nvcc_threads = compute_jobs()
     run(
         [sys.executable, "setup.py", "bdist_wheel"],
         cwd=os.path.join(repo_dir, "hopper"),
         # Without FORCE_BUILD, setup.py silently downloads a prebuilt release
         # wheel built against a different CUDA/torch than the image.
-        env={"MAX_JOBS": "96", "FLASH_ATTENTION_FORCE_BUILD": "TRUE"},
+        env={"MAX_JOBS": str(max_jobs), "NVCC_THREADS": str(nvcc_threads),
+             "FLASH_ATTENTION_FORCE_BUILD": "TRUE"},
     )
 
-    hopper_dist = os.path.join(repo_dir, "hopper", "dist")
     for f in os.listdir(hopper_dist):
         if f.endswith(".whl"):
             shutil.copy2(os.path.join(hopper_dist, f), WHEEL_DIR)
 
-    shutil.rmtree(repo_dir)
-
 
 def _build_apex(args):
+    max_jobs, nvcc_threads = compute_jobs()
+    # --parallel builds that many extensions at once and each one runs its
+    # own ninja, which defaults to every core. Split the job budget between
+    # the two levels so the total stays at max_jobs.
+    parallel = min(max_jobs, APEX_MAX_PARALLEL_EXTENSIONS)
     run(
         [sys.executable, "-m", "pip", "wheel",
          "-v", "--no-build-isolation", "--no-deps",
-         "--config-settings", "--build-option=--cpp_ext --cuda_ext --parallel 8",
-         "git+https://github.com/NVIDIA/apex.git@10417aceddd7d5d05d7cbf7b0fc2daad1105f8b4",
+         "--config-settings", f"--build-option=--cpp_ext --cuda_ext --parallel {parallel}",
+         f"git+https://github.com/NVIDIA/apex.git@{APEX_COMMIT}",
          "-w", WHEEL_DIR],
-        env={"NVCC_APPEND_FLAGS": "--threads 4"},
+        env={"MAX_JOBS": str(max(1, max_jobs // parallel)),
+             "NVCC_APPEND_FLAGS": f"--threads {nvcc_threads}"},
     )
 
 
@@ -99,7 +462,7 @@ def _build_int4_qat(args):
     if os.path.exists(miles_dir):
         shutil.rmtree(miles_dir)
 
-    run(["git", "clone", "https://github.com/radixark/miles.git", miles_dir])
+    git_cached_clone("https://github.com/radixark/miles.git", None, miles_dir)
     run(
         [sys.executable, "-m", "pip", "wheel", ".",
          "-v", "--no-build-isolation", "--no-deps",
@@ -112,40 +475,6 @@ def _build_transformer_engine(args):
     build_transformer_engine.build(args, WHEEL_DIR, run)
 
 
-def _build_causal_conv1d(args):
-    # FORCE_BUILD: upstream setup.py otherwise downloads its own prebuilt wheel
-    # when one matches, which never exists for aarch64/cu13 and may mismatch
-    # this image's torch build on x86.
-    run(
-        [sys.executable, "-m", "pip", "wheel",
-         "causal-conv1d==1.6.1",
-         "-v", "--no-build-isolation", "--no-deps",
-         "-w", WHEEL_DIR],
-        env={"CAUSAL_CONV1D_FORCE_BUILD": "TRUE", "MAX_JOBS": "64"},
-    )
-
-
-def _build_mamba_ssm(args):
-    # FORCE_BUILD: same reason as causal-conv1d.
-    run(
-        [sys.executable, "-m", "pip", "wheel",
-         "mamba-ssm==2.3.1",
-         "-v", "--no-build-isolation", "--no-deps",
-         "-w", WHEEL_DIR],
-        env={"MAMBA_FORCE_BUILD": "TRUE", "MAX_JOBS": "64"},
-    )
-
-
-def _build_fast_hadamard(args):
-    run(
-        [sys.executable, "-m", "pip", "wheel",
-         "git+https://github.com/Dao-AILab/fast-hadamard-transform.git@e7706faf8d1c3b9f241e36860640ad1dac644ede",
-         "-v", "--no-build-isolation", "--no-deps",
-         "-w", WHEEL_DIR],
-        env={"MAX_JOBS": "64"},
-    )
-
-
 def _build_sgl_router(args):
     """Build sgl-router Python wheel and standalone binary from source."""
     cfg = build_sglang_gateway.BuildConfig(bootstrap_rust=args.bootstrap_rust)
@@ -168,9 +497,8 @@ def _build_mooncake(args):
     if os.path.exists(repo_dir):
         shutil.rmtree(repo_dir)
 
-    run(["git", "clone", "https://github.com/kvcache-ai/Mooncake.git", repo_dir])
-    run(["git", "checkout", MOONCAKE_COMMIT], cwd=repo_dir)
-    run(["git", "submodule", "update", "--init", "--recursive"], cwd=repo_dir)
+    git_cached_clone("https://github.com/kvcache-ai/Mooncake.git", MOONCAKE_COMMIT, repo_dir)
+    update_submodules(repo_dir)
     run(["bash", "dependencies.sh", "-y"], cwd=repo_dir)
 
     # The wheel version comes from pyproject.toml, not the VERSION env
@@ -180,10 +508,9 @@ def _build_mooncake(args):
     run(["grep", "-q", f'version = "{MOONCAKE_VERSION}"',
          "mooncake-wheel/pyproject.toml"], cwd=repo_dir)
 
-    torch_version = subprocess.check_output(
-        [sys.executable, "-c", "import torch; print(torch.__version__.split('+')[0])"],
-        text=True,
-    ).strip()
+    # Read from the installed dist's metadata rather than a python -c that
+    # imports torch just to print its version.
+    torch_version = importlib.metadata.version("torch").split("+")[0]
 
     build_env = {
         "BUILD_WITH_EP": "1",
@@ -204,7 +531,7 @@ def _build_mooncake(args):
          f"-DPython3_EXECUTABLE={sys.executable}"],
         cwd=build_dir, env=build_env,
     )
-    run(["cmake", "--build", ".", f"-j{os.cpu_count()}"], cwd=build_dir, env=build_env)
+    run(["cmake", "--build", ".", f"-j{_cpu_share()}"], cwd=build_dir, env=build_env)
     run(["cmake", "--install", "."], cwd=build_dir, env=build_env)
 
     if args.arch == "x86":
@@ -230,14 +557,14 @@ def _build_mooncake(args):
 
 
 STEPS = {
-    "flash-attn": _build_flash_attn,
+    "flash-attn": functools.partial(_build_pip_wheels, ["flash-attn"]),
     "flash-attn-hopper": _build_flash_attn_hopper,
     "apex": _build_apex,
     "int4_qat": _build_int4_qat,
     "te": _build_transformer_engine,
-    "causal-conv1d": _build_causal_conv1d,
-    "mamba-ssm": _build_mamba_ssm,
-    "fast-hadamard": _build_fast_hadamard,
+    "causal-conv1d": functools.partial(_build_pip_wheels, ["causal-conv1d"]),
+    "mamba-ssm": functools.partial(_build_pip_wheels, ["mamba-ssm"]),
+    "fast-hadamard": functools.partial(_build_pip_wheels, ["fast-hadamard"]),
     "sgl-router": _build_sgl_router,
     "mooncake": _build_mooncake,
 }
@@ -245,6 +572,68 @@ STEPS = {
 STEP_NAMES = ", ".join(STEPS)
 
 
+def _expected_outputs(args):
+    """What each pinned step writes to WHEEL_DIR: name -> (wheel globs, pin).
+
+    cmd_build skips a step once all of its globs match and its stamp (see
+    _build_stamp) equals the current one, unless --force. The pin is
+    whatever identifies the source, since apex, FA3 and fast-hadamard wheel
+    names don't carry their commit. int4_qat and sgl-router build branch
+    tips, so they always rebuild.
+    """
+    arch = "x86_64" if args.arch == "x86" else args.arch
+    whl = f"{PY_TAG}-*{arch}.whl"
+    te = build_transformer_engine
+    return {
+        "flash-attn": ([f"flash_attn-{FLASH_ATTN_VERSION}-{whl}"], FLASH_ATTN_VERSION),
+        # hopper/setup.py's Python tag varies between revisions; match platform only.
+        "flash-attn-hopper": ([f"flash_attn_3-*{arch}.whl"], FLASH_ATTN_HOPPER_COMMIT),
+        "apex": ([f"apex-*-{whl}"], APEX_COMMIT),
+        "te": (te.expected_wheels(args), f"{te.TE_VERSION}@{te.TE_COMMIT}"),
+        "causal-conv1d": ([f"causal_conv1d-{CAUSAL_CONV1D_VERSION}-{whl}"],
+                          CAUSAL_CONV1D_VERSION),
+        "mamba-ssm": ([f"mamba_ssm-{MAMBA_SSM_VERSION}-{whl}"], MAMBA_SSM_VERSION),
+        "fast-hadamard": ([f"fast_hadamard_transform-*-{whl}"],
+                          PIP_WHEEL_STEPS["fast-hadamard"][0]),
+        "mooncake": ([f"mooncake_transfer_engine*-{MOONCAKE_VERSION}-*{arch}.whl"],
+                     MOONCAKE_COMMIT),
+    }
+
+
+def _stamp_path(name):
+    # A dot-dir, so upload (*.whl / *.tar.gz) never sees it.
+    return os.path.join(WHEEL_DIR, ".stamps", f"{name}.json")
+
+
+def _build_stamp(pin):
+    """Inputs a wheel was built from that its file name doesn't show."""
+    return {
+        "pin": pin,
+        "cuda": os.environ["CUDA_VERSION"],
+        "torch_cuda_arch_list": os.environ["TORCH_CUDA_ARCH_LIST"],
+    }
+
+
+def _already_built(name, patterns, pin):
+    if not all(glob.glob(os.path.join(WHEEL_DIR, p)) for p in patterns):
+        return False
+    try:
+        with open(_stamp_path(name)) as f:
+            return json.load(f) == _build_stamp(pin)
+    except (OSError, ValueError):
+        return False
+
+
+def _write_stamps(names, expected):
+    """Record what the just-built steps in *names* were built from."""
+    for name in names:
+        if name not in expected:
+            continue
+        os.makedirs(os.path.dirname(_stamp_path(name)), exist_ok=True)
+        with open(_stamp_path(name), "w") as f:
+            json.dump(_build_stamp(expected[name][1]), f)
+
+
 # ── commands ─────────────────────────────────────────────────
 
 def _validate_target(args):
@@ -254,22 +643,146 @@ def _validate_target(args):
         raise ValueError("cu129 currently supports only --arch x86")
 
 
+def _plan_jobs(names):
+    """Turn selected step names into (label, fn, steps) jobs, batching PIP_WHEEL_STEPS into one."""
+    batched = [name for name in names if name in PIP_WHEEL_STEPS]
+    jobs = []
+    for name in names:
+        if name not in PIP_WHEEL_STEPS:
+            jobs.append((name, STEPS[name], [name]))
+        elif name == batched[0]:
+            label = name if len(batched) == 1 else "pip-wheel"
+            jobs.append((label, functools.partial(_build_pip_wheels, batched), batched))
+    return jobs
+
+
+def _build_step_logged(name, fn, args, cpu_budget, log_path):
+    """Pool worker: run one job with stdout/stderr (and its children's) sent to log_path."""
+    global _cpu_budget
+    _cpu_budget = cpu_budget
+    # Steps that don't call compute_jobs() themselves (int4_qat, TE's torch
+    # extension, the sgl-router cargo build) would otherwise use every core.
+    max_jobs, nvcc_threads = compute_jobs()
+    os.environ.update(MAX_JOBS=str(max_jobs), NVCC_THREADS=str(nvcc_threads),
+                      CARGO_BUILD_JOBS=str(cpu_budget))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(log_path, "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            fn(args)
+        except SystemExit as exc:
+            # run() exits on a failed command; surface it as an ordinary error
+            # so the parent can report the step instead of losing the worker.
+            raise RuntimeError(f"{name} exited with code {exc.code}") from None
+        except Exception:
+            # Only the message reaches the parent; keep the traceback in the log.
+            traceback.print_exc()
+            raise
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def _build_concurrently(args, jobs, expected):
+    """Run independent build jobs in parallel worker processes, one log per job."""
+    workers = min(args.jobs, len(jobs))
+    cpu_budget = max(1, (os.cpu_count() or 1) // workers)
+    log_dir = os.path.join(WHEEL_DIR, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    print(f"\nBuilding {len(jobs)} jobs with {workers} workers, "
+          f"{cpu_budget} CPUs each; logs in {log_dir}")
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for name, fn, steps in jobs:
+            log_path = os.path.join(log_dir, f"{name}.log")
+            futures[pool.submit(_build_step_logged, name, fn, args, cpu_budget, log_path)] = (
+                name, steps, log_path)
+        for future in concurrent.futures.as_completed(futures):
+            name, steps, log_path = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                print(f">>> {name} FAILED: {exc} (see {log_path})")
+                failed.append(name)
+            else:
+                _write_stamps(steps, expected)
+                print(f">>> {name} done")
+
+    if failed:
+        print(f"FAILED steps: {', '.join(failed)}")
+        sys.exit(1)
+
+
 def cmd_build(args):
     """Build all GPU wheels into the wheel output directory."""
     _validate_target(args)
     _setup_env(args)
     os.makedirs(WHEEL_DIR, exist_ok=True)
 
-    selected = {s.lower() for s in (args.only or [])}
-    for name, fn in STEPS.items():
+    selected = set(args.only or [])
+    expected = _expected_outputs(args)
+    names = []
+    for name in STEPS:
         if selected and name not in selected:
             print(f"\nSkipping {name}")
             continue
-        print(f"\n>>> Building {name} ...")
-        fn(args)
+        if not args.force and name in expected and _already_built(name, *expected[name]):
+            print(f"\nSkipping {name}: already built in {WHEEL_DIR} (--force to rebuild)")
+            continue
+        names.append(name)
+
+    global _pip_daemon
+    jobs = _plan_jobs(names)
+    if args.jobs > 1 and len(jobs) > 1:
+        if args.pip_daemon:
+            print("--pip-daemon is ignored with --jobs > 1")
+        _build_concurrently(args, jobs, expected)
+    else:
+        if args.pip_daemon:
+            _pip_daemon = _PipDaemon()
+        try:
+            for name, fn, steps in jobs:
+                print(f"\n>>> Building {name} ...")
+                fn(args)
+                _write_stamps(steps, expected)
+        finally:
+            if _pip_daemon is not None:
+                _pip_daemon.close()
+                _pip_daemon = None
+
+    if args.compiler_cache and shutil.which("sccache"):
+        subprocess.run(["sccache", "--show-stats"])
 
     print(f"\nDone. Wheels in {WHEEL_DIR}:")
-    run(["ls", "-lh", WHEEL_DIR])
+    print_wheel_summary(_wheel_dir_assets())
+
+
+def _wheel_dir_assets():
+    """Release assets in WHEEL_DIR: wheels, then the .tar.gz binaries, each sorted by name."""
+    try:
+        with os.scandir(WHEEL_DIR) as it:
+            entries = [e for e in it if e.is_file() and e.name.endswith((".whl", ".tar.gz"))]
+    except FileNotFoundError:
+        return []
+    return sorted(entries, key=lambda e: (not e.name.endswith(".whl"), e.name))
+
+
+def print_wheel_summary(entries):
+    total = 0
+    for entry in entries:
+        size = entry.stat().st_size
+        total += size
+        print(f"{size / 1024**2:>8.1f} MB  {entry.name}")
+    print(f"{total / 1024**2:>8.1f} MB  total ({len(entries)} files)")
 
 
 def _gh_json(gh_args):
@@ -287,6 +800,40 @@ def _latest_versioned_release(tag):
     return max(candidates, key=lambda r: r["createdAt"])["tagName"]
 
 
+# gh uploads one asset per call; GitHub throttles many parallel uploads
+# to one repo, so only a few run at once.
+UPLOAD_CONCURRENCY = 4
+
+
+def _upload_assets(tag, paths, *gh_flags):
+    """Upload *paths* to release *tag* concurrently; exit if any upload failed."""
+    if not paths:
+        return
+
+    def upload(path):
+        return run(["gh", "release", "upload", tag, path, "--repo", REPO, *gh_flags],
+                   check=False)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(paths), UPLOAD_CONCURRENCY)) as pool:
+        codes = list(pool.map(upload, paths))
+    failed = [os.path.basename(p) for p, code in zip(paths, codes) if code != 0]
+    if failed:
+        print(f"FAILED to upload: {', '.join(failed)}")
+        sys.exit(1)
+
+
+def _narrowed_arch_steps(default):
+    """(step, arch list) for stamped steps not built for the *default* arch list."""
+    narrowed = []
+    for path in sorted(glob.glob(_stamp_path("*"))):
+        with open(path) as f:
+            arch_list = json.load(f).get("torch_cuda_arch_list")
+        if arch_list != default:
+            narrowed.append((os.path.basename(path)[:-len(".json")], arch_list))
+    return narrowed
+
+
 def cmd_upload(args):
     """Sync the wheel output directory into the rolling cu<cuda>-<arch> release.
 
@@ -302,16 +849,20 @@ def cmd_upload(args):
     tag = f"cu{args.cuda}-{arch_str}"
     title = f"CUDA {cuda_major}.{cuda_minor} + {arch_str}"
 
-    local = (sorted(glob.glob(os.path.join(WHEEL_DIR, "*.whl")))
-             + sorted(glob.glob(os.path.join(WHEEL_DIR, "*.tar.gz"))))
+    local = _wheel_dir_assets()
     if not local:
         print(f"No .whl or .tar.gz files found in {WHEEL_DIR}")
         sys.exit(1)
 
-    exists = subprocess.run(
-        ["gh", "release", "view", tag, "--repo", REPO],
-        capture_output=True,
-    ).returncode == 0
+    narrowed = _narrowed_arch_steps(_default_arch_list(args.arch))
+    if narrowed and not args.allow_custom_arch_list:
+        for name, arch_list in narrowed:
+            print(f"{name} was built for TORCH_CUDA_ARCH_LIST={arch_list!r}")
+        print(f"Release wheels must cover {_default_arch_list(args.arch)!r}; rebuild "
+              "without --arch-list or pass --allow-custom-arch-list")
+        sys.exit(1)
+
+    exists = run(["gh", "release", "view", tag, "--repo", REPO], check=False) == 0
 
     if not exists:
         run(["gh", "release", "create", tag, "--repo", REPO, "--title", title,
@@ -321,16 +872,15 @@ def cmd_upload(args):
             print(f"Seeding {tag} from legacy release {seed}")
             seed_dir = tempfile.mkdtemp(prefix="seed-wheels-")
             run(["gh", "release", "download", seed, "--repo", REPO, "--dir", seed_dir])
-            for f in sorted(os.listdir(seed_dir)):
-                run(["gh", "release", "upload", tag, os.path.join(seed_dir, f), "--repo", REPO])
+            _upload_assets(tag, [os.path.join(seed_dir, f) for f in sorted(os.listdir(seed_dir))])
             shutil.rmtree(seed_dir)
 
     remote = {a["name"] for a in
               _gh_json(["release", "view", tag, "--repo", REPO, "--json", "assets"])["assets"]}
 
     print(f"\nSyncing {len(local)} local assets into release '{tag}'")
-    for path in local:
-        name = os.path.basename(path)
+    for entry in local:
+        name = entry.name
         if name.endswith(".whl"):
             # A version bump changes the wheel filename; drop the superseded
             # asset so the Dockerfile's <dist>-*.whl glob stays unambiguous.
@@ -339,8 +889,8 @@ def cmd_upload(args):
                           if r.endswith(".whl") and r.split("-")[0] == dist and r != name]:
                 run(["gh", "release", "delete-asset", tag, stale, "--repo", REPO, "--yes"])
                 remote.discard(stale)
-        run(["gh", "release", "upload", tag, path, "--repo", REPO, "--clobber"])
         remote.add(name)
+    _upload_assets(tag, [entry.path for entry in local], "--clobber")
 
     names = sorted({r.split("-")[0] for r in remote if r.endswith(".whl")})
     run(["gh", "release", "edit", tag, "--repo", REPO, "--title", title,
@@ -358,10 +908,24 @@ def main():
         "build", help="Build all GPU wheels into the wheel output directory")
     p_build.add_argument("--cuda", default="129", help="CUDA version, e.g. 129, 130")
     p_build.add_argument("--arch", default="x86", choices=["x86", "aarch64"], help="Architecture")
-    p_build.add_argument("--only", nargs="+", help=f"Only run specific steps ({STEP_NAMES})")
+    p_build.add_argument("--only", nargs="+", type=str.lower, choices=list(STEPS),
+                         metavar="STEP", help=f"Only run specific steps ({STEP_NAMES})")
+    p_build.add_argument("--arch-list",
+                         help="TORCH_CUDA_ARCH_LIST to compile for, e.g. '9.0' or '8.0;9.0' "
+                              "(default: every arch the release supports for --arch)")
+    p_build.add_argument("--force", action="store_true",
+                         help="Rebuild steps whose wheels are already in WHEEL_DIR")
+    p_build.add_argument("--jobs", type=int, default=1,
+                         help="Build up to N steps concurrently, splitting CPUs between them "
+                              "(output goes to per-step logs under WHEEL_DIR/logs)")
     p_build.add_argument("--no-bootstrap-rust", dest="bootstrap_rust", action="store_false",
                          help="Don't auto-install Rust toolchain")
-    p_build.set_defaults(func=cmd_build, bootstrap_rust=True)
+    p_build.add_argument("--pip-daemon", action="store_true",
+                         help="Run pip commands in one long-lived process via pip's internal "
+                              "API instead of a fresh interpreter each (experimental)")
+    p_build.add_argument("--no-compiler-cache", dest="compiler_cache", action="store_false",
+                         help="Don't compile through sccache even if it is installed")
+    p_build.set_defaults(func=cmd_build, bootstrap_rust=True, compiler_cache=True)
 
     # ── upload ───────────────────────────────────────────────
     p_upload = sub.add_parser(
@@ -370,9 +934,14 @@ def main():
     )
     p_upload.add_argument("--cuda", default="129", help="CUDA version, e.g. 129, 130")
     p_upload.add_argument("--arch", default="x86", choices=["x86", "aarch64"], help="Architecture")
+    p_upload.add_argument("--allow-custom-arch-list", action="store_true",
+                          help="Upload even if some wheels were built for a non-default "
+                               "TORCH_CUDA_ARCH_LIST (build --arch-list)")
     p_upload.set_defaults(func=cmd_upload)
 
     args = parser.parse_args()
+    if args.func is cmd_build and args.jobs < 1:
+        p_build.error(f"--jobs must be at least 1, got {args.jobs}")
     args.func(args)
 
 
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """Install and test GPU wheels built by build_wheels.py."""
 
+import concurrent.futures
+import enum
 import glob
 import importlib.metadata
 import os
@@ -12,9 +14,6 @@ import typer
 
 app = typer.Typer(help="Install and test GPU wheels.")
 
-STEP_NAMES = ("flash-attn, flash-attn-hopper, apex, int4_qat, te, "
-              "causal-conv1d, mamba-ssm, fast-hadamard, sgl-model-gateway, mooncake")
-
 
 def run(cmd, *, env=None):
     """Run a command, streaming output. Exit on failure."""
@@ -272,18 +271,26 @@ TEST_STEPS = {
     "mooncake": _test_mooncake,
 }
 
+# Steps that never touch torch; their subprocess skips importing it and
+# initializing CUDA just to print the GPU banner.
+NO_TORCH_TEST_STEPS = {"sgl-model-gateway", "mooncake"}
+
+# --only choices, so Typer rejects a misspelled step up front instead of
+# every step being silently skipped.
+Step = enum.Enum("Step", {name: name for name in TEST_STEPS}, type=str)
+
 
 # ── commands ──────────────────────────────────────────────────
 
 @app.command()
 def install(
     wheel_dir: Annotated[str, typer.Argument(help="Directory containing .whl files")] = "/tmp/wheels",
-    only: Annotated[Optional[list[str]], typer.Option(
-        help=f"Only install specific wheels ({STEP_NAMES})",
+    only: Annotated[Optional[list[Step]], typer.Option(
+        case_sensitive=False, help="Only install specific wheels",
     )] = None,
 ):
     """Install all wheels from WHEEL_DIR."""
-    selected = {s.lower() for s in (only or [])}
+    selected = {s.value for s in (only or [])}
     for name, fn in INSTALL_STEPS.items():
         if selected and name not in selected:
             print(f"\nSkipping {name}")
@@ -296,22 +303,40 @@ def install(
     print("\nInstall done.")
 
 
+def _run_test_step(name: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, __file__, "--run-step", name],
+        capture_output=True, text=True,
+        # One-shot interpreters: writing .pyc for torch & co. is pure overhead.
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+
+
 @app.command()
 def test(
-    only: Annotated[Optional[list[str]], typer.Option(
-        help=f"Only test specific wheels ({STEP_NAMES})",
+    only: Annotated[Optional[list[Step]], typer.Option(
+        case_sensitive=False, help="Only test specific wheels",
     )] = None,
+    jobs: Annotated[int, typer.Option(
+        min=1, help="Number of test subprocesses to run at once",
+    )] = min(len(TEST_STEPS), 4),
 ):
     """Test installed wheels (forward + backward pass). Each step runs in an isolated subprocess."""
-    selected = {s.lower() for s in (only or [])}
-    passed, failed, skipped = [], [], []
-
-    for name in TEST_STEPS:
-        if selected and name not in selected:
-            skipped.append(name)
-            continue
-        print(f"\n>>> Testing {name} ...")
-        result = subprocess.run([sys.executable, __file__, "--run-step", name])
+    selected = {s.value for s in (only or [])}
+    passed, failed = [], []
+
+    names = [name for name in TEST_STEPS if not selected or name in selected]
+    skipped = [name for name in TEST_STEPS if name not in names]
+    print(f"\n>>> Testing {', '.join(names)} ({jobs} at a time) ...")
+    # The steps are small and mostly import-bound, so they share one GPU
+    # fine; output is buffered per step and printed in order afterwards.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = dict(zip(names, pool.map(_run_test_step, names)))
+
+    for name, result in results.items():
+        print(f"\n>>> {name}")
+        sys.stdout.write(result.stdout)
+        sys.stderr.write(result.stderr)
         if result.returncode == 0:
             passed.append(name)
         else:
@@ -335,21 +360,25 @@ def test(
 @app.command()
 def install_and_test(
     wheel_dir: Annotated[str, typer.Argument(help="Directory containing .whl files")] = "/tmp/wheels",
-    only: Annotated[Optional[list[str]], typer.Option(
-        help=f"Only run specific steps ({STEP_NAMES})",
+    only: Annotated[Optional[list[Step]], typer.Option(
+        case_sensitive=False, help="Only run specific steps",
     )] = None,
+    jobs: Annotated[int, typer.Option(
+        min=1, help="Number of test subprocesses to run at once",
+    )] = min(len(TEST_STEPS), 4),
 ):
     """Install all wheels from WHEEL_DIR, then test them."""
     install(wheel_dir=wheel_dir, only=only)
-    test(only=only)
+    test(only=only, jobs=jobs)
 
 
 if __name__ == "__main__":
     # Internal subprocess dispatch: python test_wheels.py --run-step <name>
     if len(sys.argv) == 3 and sys.argv[1] == "--run-step":
-        import torch
         step = sys.argv[2]
-        print(f"GPU: {torch.cuda.get_device_name(0)}, SM: {torch.cuda.get_device_capability()}")
+        if step not in NO_TORCH_TEST_STEPS:
+            import torch
+            print(f"GPU: {torch.cuda.get_device_name(0)}, SM: {torch.cuda.get_device_capability()}")
         TEST_STEPS[step]()
         sys.exit(0)
 